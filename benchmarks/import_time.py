@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+   benchmarks.import_time
+   ~~~~~~~~~~~~~~~~~~~~~~
+
+   Measure the cold-start import cost of each kingdomlib submodule and
+   check it against its budget. Every import runs in a fresh interpreter
+   so nothing is cached. Exits non-zero when a budget is exceeded or a
+   module can not be imported. ``-X importtime`` needs Python 3.7, older
+   interpreters only check the forbidden imports::
+
+       $ python benchmarks/import_time.py
+"""
+
+import subprocess
+import sys
+
+HEAVY = ('flask', 'flask_wtf', 'sqlalchemy', 'cachelib', 'redis')
+
+# module: (milliseconds, third-party packages it must not import)
+BUDGETS = {
+    'kingdomlib': (20, HEAVY),
+    'kingdomlib.log': (50, HEAVY),
+    'kingdomlib.utils': (20, HEAVY),
+    'kingdomlib.errors': (300, HEAVY),
+    'kingdomlib.cache': (300, HEAVY),
+    'kingdomlib.database': (1000, ('flask_wtf', 'cachelib', 'redis')),
+    'kingdomlib.views': (1000, ('sqlalchemy', 'cachelib', 'redis')),
+}
+RUNS = 5
+
+IMPORTED = ("import sys, {0}; "
+            "print(' '.join({{m.split('.')[0] for m in sys.modules}}))")
+
+HAS_IMPORTTIME = sys.version_info >= (3, 7)
+
+
+def import_time(module):
+    """Returns the cumulative import time of ``module`` in microseconds,
+    or ``None`` if it can not be imported.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stderr=subprocess.PIPE, universal_newlines=True,
+    )
+    if proc.returncode:
+        return None
+    for line in reversed(proc.stderr.splitlines()):
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or fields[2].strip() != module:
+            continue
+        try:
+            return int(fields[1])
+        except ValueError:
+            continue
+    return None
+
+
+def imported_packages(module):
+    """Returns the top level packages loaded by importing ``module``"""
+    proc = subprocess.run(
+        [sys.executable, '-c', IMPORTED.format(module)],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    if proc.returncode:
+        return None
+    return set(proc.stdout.split())
+
+
+def main():
+    failed = False
+    for module, (budget, forbidden) in BUDGETS.items():
+        packages = imported_packages(module)
+        if packages is None:
+            failed = True
+            print(f'{module:<24} {"unavailable":>11}  can not be imported')
+            continue
+        errors = [f'imports {p}' for p in forbidden if p in packages]
+
+        timing = f'{"skipped":>11}'
+        if HAS_IMPORTTIME:
+            rv = [import_time(module) for _ in range(RUNS)]
+            if None in rv:
+                errors.append('no import time reported')
+            else:
+                rv.sort()
+                ms = rv[len(rv) // 2] / 1000.0
+                timing = f'{ms:>8.1f} ms'
+                if ms > budget:
+                    errors.append(f'over budget of {budget} ms')
+        failed = failed or bool(errors)
+        print(f'{module:<24} {timing}  {", ".join(errors) or "ok"}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
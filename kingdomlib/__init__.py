@@ -1,4 +1,27 @@
 # coding: utf-8
 # flake8: noqa
 
-from .import cache, database, errors, log, utils, views
+import importlib
+import sys
+
+__all__ = ['cache', 'database', 'errors', 'log', 'utils', 'views']
+
+
+def __getattr__(name):
+    """Import submodules on first access, so that ``import kingdomlib``
+    does not pull in Flask, SQLAlchemy and the cache backends.
+    """
+    if name in __all__:
+        module = importlib.import_module(f'.{name}', __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if sys.version_info < (3, 7):
+    # module level __getattr__ needs PEP 562, import eagerly instead
+    from .import cache, database, errors, log, utils, views
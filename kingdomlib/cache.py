@@ -8,9 +8,6 @@ from functools import wraps
 from contextlib import contextmanager
 from werkzeug.utils import cached_property
 from werkzeug.local import LocalProxy
-from cachelib import NullCache, SimpleCache, FileSystemCache
-from cachelib import MemcachedCache, RedisCache
-from flask import g, current_app
 
 
 class CacheFactory(object):
@@ -52,6 +49,7 @@ class CacheFactory(object):
 
     def _null(self, **kwargs):
         """Returns a :class:`NullCache` instance"""
+        from cachelib import NullCache
         return NullCache()
 
     def _simple(self, **kwargs):
@@ -59,11 +57,13 @@ class CacheFactory(object):
         .. warning::
             This cache system might not be thread safe. Use with caution.
         """
+        from cachelib import SimpleCache
         kwargs.update(dict(threshold=self._config('threshold', 500)))
         return SimpleCache(**kwargs)
 
     def _memcache(self, **kwargs):
         """Returns a :class:`MemcachedCache` instance"""
+        from cachelib import MemcachedCache
         kwargs.update(dict(
             servers=self._config('MEMCACHED_SERVERS', None),
             key_prefix=self._config('key_prefix', None),
@@ -72,6 +72,7 @@ class CacheFactory(object):
 
     def _redis(self, **kwargs):
         """Returns a :class:`RedisCache` instance"""
+        from cachelib import RedisCache
         kwargs.update(dict(
             host=self._config('REDIS_HOST', 'localhost'),
             port=self._config('REDIS_PORT', 6379),
@@ -83,6 +84,7 @@ class CacheFactory(object):
 
     def _filesystem(self, **kwargs):
         """Returns a :class:`FileSystemCache` instance"""
+        from cachelib import FileSystemCache
         kwargs.update(dict(
             threshold=self._config('threshold', 500),
         ))
@@ -97,6 +99,8 @@ FIVE_MINUTES = 300
 
 def use_redis(prefix='kingdom'):
     """Get redis object from app extensions"""
+    from flask import g, current_app
+
     key = f'{prefix}_redis'
 
     d = getattr(g, key, None)
@@ -107,6 +111,8 @@ def use_redis(prefix='kingdom'):
 
 
 def use_cache(prefix='kingdom'):
+    from flask import current_app
+
     return current_app.extensions[prefix + '_cache']
 
 
@@ -127,6 +133,8 @@ redis = LocalProxy(use_redis)
 
 @contextmanager
 def execute_pipeline(prefix='kingdom'):
+    from flask import g, current_app
+
     key = prefix + '_redis'
     redis = current_app.extensions[key]
     with redis.pipeline() as pipe:
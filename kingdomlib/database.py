@@ -4,14 +4,19 @@
    ~~~~~~~~~~~~~~~~~~~
 """
 
-from flask import abort, json
-from sqlalchemy import func, event
+import itertools
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, event, func, or_, text, tuple_
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.inspection import inspect
-from sqlalchemy.orm import Query, class_mapper
+from sqlalchemy.orm import Query, Session, class_mapper, object_session
 from sqlalchemy.orm.exc import UnmappedClassError
 
-from .cache import cache, ONE_DAY, FIVE_MINUTES
-from .errors import NotFound
+from .cache import cache, redis, ONE_DAY, FIVE_MINUTES
 from .utils import is_json, json_encode
 
 CACHE_TIMES = {
@@ -19,105 +24,191 @@ CACHE_TIMES = {
     'count': ONE_DAY,
     'ff': FIVE_MINUTES,
     'fc': FIVE_MINUTES,
+    'approx': FIVE_MINUTES,
+    'marker': ONE_DAY,
+    # items read from a replica may lag behind the primary
+    'replica': 30,
 }
 
 CACHE_MODEL_PREFIX = 'db'
 
+WARM_CHUNK_SIZE = 500
+WARM_TTL_JITTER = 600
+
+READ_YOUR_WRITES = 5
+REPLICA_RETRY_AFTER = 30
+
+# cache changes queued on the session until its transaction commits
+PENDING = ('counts', 'distinct', 'markers')
+
+INCR_IF_EXISTS = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[1])
+end
+"""
+
 
 class CacheQuery(Query):
     def get(self, ident):
         mapper = self._only_full_mapper_zero('get')
 
-        if isinstance(ident, (list, tuple)):
-            suffix = '-'.join(map(str, ident))
-        else:
-            suffix = str(ident)
-
-        key = mapper.class_.generate_cache_prefix('get') + suffix
+        key = mapper.class_.generate_cache_prefix('get') + _ident_suffix(ident)
         rv = cache.get(key)
         if rv:
             return rv
-        rv = super(CacheQuery, self).get(ident)
+        rv, timeout = self._read(lambda q: Query.get(q, ident),
+                                 CACHE_TIMES['get'])
         if rv is None:
             return None
-        cache.set(key, rv, CACHE_TIMES['get'])
+        cache.set(key, rv, timeout)
         return rv
 
     def get_dict(self, ident):
+        """Returns a dict of items keyed by ``ident``, ``None`` for missing
+        items. Composite primary keys are keyed by tuples, others by
+        ``str(ident)``.
+        """
         if not ident:
             return {}
 
         mapper = self._only_full_mapper_zero('get')
-        if len(mapper.primary_key) != 1:
-            raise NotImplementedError
-
         prefix = mapper.class_.generate_cache_prefix('get')
-        keys = {prefix + str(i) for i in ident}
-        rv = cache.get_dict(*keys)
+        idents = {_ident_suffix(i): i for i in ident}
+        cached = cache.get_dict(*[prefix + k for k in idents])
 
-        missed = {i for i in ident if rv[prefix + str(i)] is None}
-
-        rv = {k.lstrip(prefix): rv[k] for k in rv}
+        rv = {}
+        missed = []
+        for suffix, i in idents.items():
+            item = rv[_ident_key(i)] = cached[prefix + suffix]
+            if item is None:
+                missed.append(i)
 
         if not missed:
             return rv
 
-        pk = mapper.primary_key[0]
-        missing = self.filter(pk.in_(missed)).all()
+        missing, timeout = self._read(lambda q: q.filter(
+            _ident_clause(q.session, mapper, missed)).all(),
+            CACHE_TIMES['get'])
         to_cache = {}
         for item in missing:
-            ident = str(getattr(item, pk.name))
-            to_cache[prefix + ident] = item
-            rv[ident] = item
+            suffix = _unique_suffix(item, mapper.primary_key)
+            to_cache[prefix + suffix] = item
+            rv[_ident_key(idents.get(suffix, suffix))] = item
 
-        cache.set_many(to_cache, CACHE_TIMES['get'])
+        cache.set_many(to_cache, timeout)
         return rv
 
     def get_many(self, ident, clean=True):
         d = self.get_dict(ident)
         if clean:
             return list(_itervalues(d, ident))
-        return [d[str(k)] for k in ident]
+        return [d[_ident_key(k)] for k in ident]
 
     def filter_first(self, **kwargs):
         mapper = self._only_entity_zero()
 
-        prefix = mapper.class_.generate_cache_prefix('ff')
-        key = prefix + '-'.join(['%s$%s' % (k, kwargs[k]) for k in kwargs])
+        key = _filter_key(mapper.class_.generate_cache_prefix('ff'), kwargs)
         rv = cache.get(key)
         if rv:
             return rv
-        rv = self.filter_by(**kwargs).first()
+        rv, timeout = self._read(lambda q: q.filter_by(**kwargs).first(),
+                                 CACHE_TIMES['ff'])
         if rv is None:
             return None
         # it is hard to invalidate this cache, expires in 2 minutes
-        cache.set(key, rv, CACHE_TIMES['ff'])
+        cache.set(key, rv, timeout)
         return rv
 
     def filter_count(self, **kwargs):
         mapper = self._only_entity_zero()
         model = mapper.class_
-        if not kwargs:
-            key = model.generate_cache_prefix('count')
-            rv = cache.get(key)
-            if rv is not None:
-                return rv
-            q = self.select_from(model).with_entities(func.count(1))
-            rv = q.scalar()
-            cache.set(key, rv, CACHE_TIMES['count'])
+        key, timeout = _count_key(model, kwargs)
+        rv = cache.get(key)
+        if rv is not None:
             return rv
+        q = self.select_from(model).with_entities(func.count(1))
+        if _is_maintained(model, kwargs):
+            # the listeners adjust this counter, it needs an exact base
+            rv = q.filter_by(**kwargs).scalar()
+        else:
+            rv, timeout = self._read(
+                lambda q: q.filter_by(**kwargs).scalar(), timeout, q)
+        cache.set(key, rv, timeout)
+        return rv
+
+    def approximate_count(self, **kwargs):
+        """Returns a row count for pages which only show "about N results".
+        Unfiltered counts come from the maintained counter, or from the
+        dialect's table statistics instead of a full scan when the counter
+        is not cached. Filtered counts fall back to :meth:`filter_count`.
+        """
+        mapper = self._only_entity_zero()
+        model = mapper.class_
+        if kwargs:
+            return self.filter_count(**kwargs)
 
-        prefix = model.generate_cache_prefix('fc')
-        key = prefix + '-'.join(['%s$%s' % (k, kwargs[k]) for k in kwargs])
+        rv = cache.get(model.generate_cache_prefix('count'))
+        if rv is not None:
+            return rv
+
+        key = model.generate_cache_prefix('approx')
         rv = cache.get(key)
-        if rv:
+        if rv is not None:
             return rv
-        q = self.select_from(model).with_entities(func.count(1))
-        rv = q.filter_by(**kwargs).scalar()
-        cache.set(key, rv, CACHE_TIMES['fc'])
+        rv = _table_estimate(self.session, mapper)
+        if rv is None:
+            return self.filter_count()
+        cache.set(key, rv, CACHE_TIMES['approx'])
         return rv
 
+    def count_distinct(self, column):
+        """Returns the estimated number of distinct values of ``column``,
+        kept in a redis HyperLogLog. The column has to be declared in
+        ``__count_distinct__`` so inserts keep the estimate up to date;
+        deleted values are never removed from it.
+        """
+        mapper = self._only_entity_zero()
+        model = mapper.class_
+        if column not in getattr(model, '__count_distinct__', ()):
+            raise ValueError(f'{column} is not in __count_distinct__')
+
+        key = model.generate_cache_prefix('hll') + column
+        if not redis.exists(key):
+            q = self.session.query(getattr(model, column)).select_from(model)
+            values = []
+            for (value,) in q.yield_per(WARM_CHUNK_SIZE):
+                if value is None:
+                    continue
+                values.append(str(value))
+                if len(values) >= WARM_CHUNK_SIZE:
+                    redis.pfadd(key, *values)
+                    values = []
+            redis.pfadd(key, *values)
+            redis.expire(key, CACHE_TIMES['count'])
+        return redis.pfcount(key)
+
+    def _read(self, fn, timeout, query=None):
+        """Run the cache miss read ``fn(query)``, on a replica if the
+        :class:`CacheProperty` has a :class:`ReplicaRouter`. Returns the
+        result and the timeout to cache it with, which is shortened when
+        a replica answered.
+        """
+        if query is None:
+            query = self
+        router = getattr(self, '_router', None)
+        if router is None:
+            return fn(query), timeout
+
+        bind_key = getattr(self._mapper_zero().class_, '__bind_key__', None)
+        rv, replica = router.read(query, fn, bind_key)
+        if replica:
+            timeout = min(timeout, CACHE_TIMES['replica'])
+        return rv, timeout
+
     def get_or_404(self, ident):
+        from flask import abort
+        from .errors import NotFound
+
         data = self.get(ident)
         if data:
             return data
@@ -129,6 +220,9 @@ class CacheQuery(Query):
         abort(404)
 
     def first_or_404(self, **kwargs):
+        from flask import abort
+        from .errors import NotFound
+
         data = self.filter_first(**kwargs)
         if data:
             return data
@@ -143,18 +237,137 @@ class CacheQuery(Query):
 
 
 class CacheProperty(object):
-    def __init__(self, sa):
+    def __init__(self, sa, replicas=None, strategy='round_robin',
+                 window=READ_YOUR_WRITES):
         self.sa = sa
+        self.router = ReplicaRouter(sa, replicas, strategy, window)
 
     def __get__(self, obj, type):
         try:
             mapper = class_mapper(type)
             if mapper:
-                return CacheQuery(mapper, session=self.sa.session())
+                q = CacheQuery(mapper, session=self.sa.session())
+                q._router = self.router
+                return q
         except UnmappedClassError:
             return None
 
 
+class ReplicaRouter(object):
+    """Routes cache miss reads to the replica binds of a Flask-SQLAlchemy
+    instance. ``binds`` defaults to the ``KINGDOM_DATABASE_REPLICAS``
+    config, a list of ``SQLALCHEMY_BINDS`` keys replicating the default
+    database, or a dict of such lists keyed by ``__bind_key__``.
+
+    :param strategy: ``round_robin`` or ``least_latency``.
+    :param window: seconds to read from the primary after a write by the
+        same client. The whole request that wrote reads from the primary.
+        Writes are only tracked inside requests, and only for databases
+        which have replicas.
+    """
+    STRATEGIES = ('round_robin', 'least_latency')
+
+    def __init__(self, sa, binds=None, strategy='round_robin',
+                 window=READ_YOUR_WRITES, retry_after=REPLICA_RETRY_AFTER):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f'`{strategy}` is not a valid strategy!')
+        self.sa = sa
+        self._binds = binds
+        self.strategy = strategy
+        self.window = window
+        self.retry_after = retry_after
+        self._counter = itertools.count()
+        self._latency = {}
+        self._down = {}
+
+    def binds(self, bind_key=None):
+        """Returns the replica binds of the ``bind_key`` database"""
+        binds = self._binds
+        if binds is None:
+            from flask import current_app
+            binds = current_app.config.get('KINGDOM_DATABASE_REPLICAS', ())
+        if isinstance(binds, dict):
+            return list(binds.get(bind_key, ()))
+        if bind_key is None:
+            return list(binds)
+        return []
+
+    def read(self, query, fn, bind_key=None):
+        """Returns ``fn(query)`` run on the first available replica,
+        falling back to the primary session of ``query``, and whether a
+        replica answered.
+        """
+        candidates = self._candidates(bind_key)
+        if not candidates or self.recent_write():
+            return fn(query), False
+
+        for bind in candidates:
+            try:
+                engine = self.sa.get_engine(bind=bind)
+            except AssertionError:
+                # Flask-SQLAlchemy asserts the bind is configured
+                self._down[bind] = time.time() + self.retry_after
+                continue
+
+            session = Session(bind=engine)
+            started = time.time()
+            try:
+                rv = fn(query.with_session(session))
+            except DBAPIError:
+                # only driver errors take a replica down, errors of the
+                # query itself raise again on the primary
+                self._down[bind] = time.time() + self.retry_after
+                continue
+            finally:
+                # detach loaded items, just like items from the cache
+                session.close()
+            self._record(bind, time.time() - started)
+            return rv, True
+        return fn(query), False
+
+    def mark_write(self, bind_key=None):
+        """Read the rest of the request, and the ``window`` after it, from
+        the primary of ``bind_key``.
+        """
+        from flask import current_app, has_request_context, request, session
+
+        if not has_request_context() or not self.binds(bind_key):
+            return
+        request.environ['kingdom.write'] = True
+        if current_app.secret_key:
+            session['_kingdom_write'] = int(time.time())
+
+    def recent_write(self):
+        from flask import current_app, has_request_context, request, session
+
+        if not has_request_context():
+            return False
+        if request.environ.get('kingdom.write'):
+            return True
+        if current_app.secret_key and '_kingdom_write' in session:
+            return time.time() - session['_kingdom_write'] < self.window
+        return False
+
+    def _candidates(self, bind_key=None):
+        now = time.time()
+        binds = [b for b in self.binds(bind_key)
+                 if self._down.get(b, 0) <= now]
+        if not binds:
+            return []
+        if self.strategy == 'least_latency':
+            return sorted(binds, key=lambda b: self._latency.get(b, 0))
+        i = next(self._counter) % len(binds)
+        return binds[i:] + binds[:i]
+
+    def _record(self, bind, elapsed):
+        # exponentially weighted moving average of the read latency
+        prev = self._latency.get(bind)
+        if prev is None:
+            self._latency[bind] = elapsed
+        else:
+            self._latency[bind] = prev * 0.8 + elapsed * 0.2
+
+
 class BaseMixin(object):
     def __getitem__(self, key):
         return getattr(self, key)
@@ -164,6 +377,8 @@ class BaseMixin(object):
                 for c in inspect(self).mapper.column_attrs}
 
     def to_json(self):
+        from flask import json
+
         return json.dumps(self.to_dict(), default=json_encode)
 
     @classmethod
@@ -173,21 +388,420 @@ class BaseMixin(object):
             return f'{prefix}|{cls.__cache_version__}'
         return f'{prefix}:'
 
+    @classmethod
+    def cache_marker(cls):
+        """Returns a token which changes whenever a transaction which
+        inserted, updated or deleted rows of this model commits.
+        """
+        rv = cache.get(cls.generate_cache_prefix('marker'))
+        if rv is None:
+            rv = _touch_marker(cls)
+        return rv
+
     @classmethod
     def __declare_last__(cls):
+        for dimension in _count_dimensions(cls):
+            for k in dimension:
+                # load the previous value on set even if it was expired,
+                # so that _move_counts finds it in the history
+                event.listen(getattr(cls, k), 'set', _receive_set,
+                             active_history=True)
+
         @event.listens_for(cls, 'after_insert')
         def receive_after_insert(mapper, conn, target):
-            cache.inc(target.generate_cache_prefix('count'))
+            _mark_write(type(target))
+            _queue_marker(target)
+            _queue_counts(target, _count_keys(target), 1)
+            _queue_distinct(target)
 
         @event.listens_for(cls, 'after_update')
         def receive_after_update(mapper, conn, target):
+            _mark_write(type(target))
+            _queue_marker(target)
             key = _unique_key(target, mapper.primary_key)
             cache.set(key, target, CACHE_TIMES['get'])
+            _move_counts(target)
+            _queue_distinct(target)
 
         @event.listens_for(cls, 'after_delete')
         def receive_after_delete(mapper, conn, target):
+            _mark_write(type(target))
+            _queue_marker(target)
             key = _unique_key(target, mapper.primary_key)
-            cache.delete_many(key, target.generate_cache_prefix('count'))
+            cache.delete(key)
+            _queue_counts(target, _count_keys(target), -1)
+
+
+def warm_cache(model, ids=None, since=None, since_column='created_at',
+               counts=None, chunk_size=WARM_CHUNK_SIZE, rate=None,
+               jitter=WARM_TTL_JITTER, session=None):
+    """Bulk load rows of ``model`` into the cache used by
+    :meth:`CacheQuery.get`, and seed the keys used by
+    :meth:`CacheQuery.filter_count`.
+
+    :param ids: only warm these primary keys.
+    :param since: only warm rows whose ``since_column`` is newer than this.
+    :param counts: a list of ``filter_count`` kwargs to seed besides the
+        total count.
+    :param chunk_size: rows per ``yield_per`` batch and per ``set_many``.
+    :param rate: maximum rows per second, ``None`` for no limit.
+    :param jitter: maximum seconds added to each chunk's and each count's
+        timeout so that warmed keys do not all expire at once.
+    :returns: the number of rows written.
+    """
+    mapper = class_mapper(model)
+    if since is not None and not hasattr(model, since_column):
+        raise ValueError(f'{model.__name__} has no column {since_column}')
+    if session is None:
+        session = _model_session(model)
+
+    q = session.query(model)
+    if since is not None:
+        q = q.filter(getattr(model, since_column) >= since)
+
+    total = 0
+    started = time.time()
+    for chunk in _iter_chunks(model, mapper, q, ids, chunk_size):
+        to_cache = {_unique_key(item, mapper.primary_key): item
+                    for item in chunk}
+        timeout = CACHE_TIMES['get'] + random.randint(0, jitter)
+        cache.set_many(to_cache, timeout)
+        total += len(to_cache)
+        if rate:
+            delay = total / float(rate) - (time.time() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+    count_query = session.query(func.count(1)).select_from(model)
+    for kwargs in [{}] + list(counts or ()):
+        key, timeout = _count_key(model, kwargs)
+        timeout += random.randint(0, jitter)
+        cache.set(key, count_query.filter_by(**kwargs).scalar(), timeout)
+    return total
+
+
+def init_app(app):
+    """Register database commands"""
+    app.cli.add_command(_warm_command())
+
+
+def _warm_command():
+    import click
+    from flask.cli import with_appcontext
+
+    @click.command('warm-cache')
+    @click.argument('models', nargs=-1, required=True)
+    @click.option('--ids', help='Comma separated primary keys to warm, '
+                  'composite keys joined with "-", e.g. 1-10,2-10.')
+    @click.option('--since', type=int,
+                  help='Only warm rows created in the last N seconds.')
+    @click.option('--since-column', default='created_at', show_default=True)
+    @click.option('--chunk-size', default=WARM_CHUNK_SIZE,
+                  show_default=True)
+    @click.option('--rate', type=int,
+                  help='Maximum rows written per second.')
+    @click.option('--jitter', default=WARM_TTL_JITTER, show_default=True,
+                  help='Maximum seconds of TTL jitter.')
+    @click.option('--count', 'counts', multiple=True,
+                  help='filter_count kwargs to seed, e.g. status=1,kind=a.')
+    @with_appcontext
+    def warm_command(models, ids, since, since_column, chunk_size, rate,
+                     jitter, counts):
+        """Pre-warm the model cache for MODELS."""
+        registry = _model_registry()
+        if ids:
+            ids = [i.strip() for i in ids.split(',') if i.strip()]
+        if since is not None:
+            since = datetime.utcnow() - timedelta(seconds=since)
+        try:
+            counts = [_parse_count(c) for c in counts]
+        except ValueError:
+            raise click.BadParameter('--count expects key=value pairs')
+
+        for name in models:
+            model = registry.get(name)
+            if model is None:
+                raise click.BadParameter(f'No such model: {name}')
+            if since is not None and not hasattr(model, since_column):
+                raise click.BadParameter(
+                    f'{name} has no column {since_column}')
+            for kwargs in counts:
+                for k in kwargs:
+                    if not hasattr(model, k):
+                        raise click.BadParameter(f'{name} has no column {k}')
+            model_ids = ids
+            primary_key = class_mapper(model).primary_key
+            if ids and len(primary_key) > 1:
+                model_ids = [tuple(i.split('-')) for i in ids]
+                if any(len(i) != len(primary_key) for i in model_ids):
+                    raise click.BadParameter(
+                        f'{name} ids need {len(primary_key)} parts')
+            total = warm_cache(model, ids=model_ids, since=since,
+                               since_column=since_column, counts=counts,
+                               chunk_size=chunk_size, rate=rate,
+                               jitter=jitter)
+            click.echo(f'{name}: {total} rows warmed')
+
+    return warm_command
+
+
+def _parse_count(value):
+    rv = {}
+    for pair in value.split(','):
+        k, v = pair.split('=', 1)
+        rv[k.strip()] = v.strip()
+    return rv
+
+
+def _iter_chunks(model, mapper, q, ids, chunk_size):
+    if ids is None:
+        chunk = []
+        for item in q.yield_per(chunk_size):
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+        return
+
+    ids = list(ids)
+    for i in range(0, len(ids), chunk_size):
+        clause = _ident_clause(q.session, mapper, ids[i:i + chunk_size])
+        yield q.filter(clause).all()
+
+
+def _cache_property(model):
+    for klass in model.__mro__:
+        for value in vars(klass).values():
+            if isinstance(value, CacheProperty):
+                return value
+    return None
+
+
+def _model_session(model):
+    prop = _cache_property(model)
+    if prop is None:
+        raise RuntimeError(f'{model.__name__} has no CacheProperty.')
+    return prop.sa.session()
+
+
+def _model_registry():
+    rv = {}
+    stack = list(BaseMixin.__subclasses__())
+    while stack:
+        model = stack.pop()
+        stack.extend(model.__subclasses__())
+        try:
+            class_mapper(model)
+        except UnmappedClassError:
+            # abstract bases and plain mixins
+            continue
+        rv[model.__name__] = model
+        rv[model.__tablename__] = model
+    return rv
+
+
+def _count_dimensions(model):
+    rv = []
+    for dimension in getattr(model, '__count_dimensions__', ()):
+        if isinstance(dimension, str):
+            dimension = (dimension,)
+        rv.append(tuple(sorted(dimension)))
+    return rv
+
+
+def _is_maintained(model, kwargs):
+    return not kwargs or tuple(sorted(kwargs)) in _count_dimensions(model)
+
+
+def _count_key(model, kwargs):
+    if not kwargs:
+        return model.generate_cache_prefix('count'), CACHE_TIMES['count']
+
+    if _is_maintained(model, kwargs):
+        # listeners adjust declared dimensions, which have to share one key
+        # whatever the order of kwargs. A base counted while another
+        # transaction commits can miss its change, so they still expire
+        # as quickly as other filtered counts.
+        kwargs = {k: kwargs[k] for k in sorted(kwargs)}
+    prefix = model.generate_cache_prefix('fc')
+    return _filter_key(prefix, kwargs), CACHE_TIMES['fc']
+
+
+def _count_keys(target, values=None):
+    model = type(target)
+    yield model.generate_cache_prefix('count')
+    for dimension in _count_dimensions(model):
+        kwargs = {k: getattr(target, k) for k in dimension}
+        if values is not None:
+            kwargs.update({k: values[k] for k in dimension if k in values})
+        yield _count_key(model, kwargs)[0]
+
+
+def _receive_set(target, value, oldvalue, initiator):
+    pass
+
+
+def _pending(target, name):
+    return object_session(target).info.setdefault(f'kingdom_{name}', {})
+
+
+def _queue_counts(target, keys, delta):
+    counts = _pending(target, 'counts')
+    for key in keys:
+        counts[key] = counts.get(key, 0) + delta
+
+
+def _incr_existing(key, delta):
+    """Atomically adds ``delta`` to a cached counter. A missing counter
+    stays missing and is recounted on read.
+    """
+    from cachelib import MemcachedCache, RedisCache
+
+    backend = cache._get_current_object()
+    if isinstance(backend, RedisCache):
+        backend._client.eval(INCR_IF_EXISTS, 1, backend.key_prefix + key,
+                             delta)
+    elif isinstance(backend, MemcachedCache):
+        # memcached never creates a missing key on incr or decr
+        if delta > 0:
+            backend.inc(key, delta)
+        else:
+            backend.dec(key, -delta)
+    elif backend.has(key):
+        backend.inc(key, delta)
+
+
+def _move_counts(target):
+    state = inspect(target)
+    previous = {}
+    for dimension in _count_dimensions(type(target)):
+        for k in dimension:
+            history = state.attrs[k].history
+            if history.deleted:
+                previous[k] = history.deleted[0]
+    if not previous:
+        return
+
+    old = set(_count_keys(target, previous))
+    new = set(_count_keys(target))
+    _queue_counts(target, old - new, -1)
+    _queue_counts(target, new - old, 1)
+
+
+def _queue_distinct(target):
+    model = type(target)
+    columns = getattr(model, '__count_distinct__', ())
+    if not columns:
+        return
+    distinct = _pending(target, 'distinct')
+    for column in columns:
+        value = getattr(target, column)
+        if value is None:
+            continue
+        key = model.generate_cache_prefix('hll') + column
+        distinct.setdefault(key, set()).add(str(value))
+
+
+def _queue_marker(target):
+    _pending(target, 'markers')[type(target)] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _receive_after_commit(session):
+    markers = session.info.pop('kingdom_markers', {})
+    if markers:
+        cache.set_many({m.generate_cache_prefix('marker'): uuid.uuid4().hex
+                        for m in markers}, CACHE_TIMES['marker'])
+
+    for key, delta in session.info.pop('kingdom_counts', {}).items():
+        if delta:
+            _incr_existing(key, delta)
+
+    distinct = session.info.pop('kingdom_distinct', {})
+    if distinct:
+        # only feed estimates which exist, count_distinct seeds the others
+        keys = list(distinct)
+        with redis.pipeline() as pipe:
+            for key in keys:
+                pipe.exists(key)
+            exists = pipe.execute()
+        with redis.pipeline() as pipe:
+            for key, found in zip(keys, exists):
+                if found:
+                    pipe.pfadd(key, *distinct[key])
+            pipe.execute()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _receive_after_rollback(session):
+    for name in PENDING:
+        session.info.pop(f'kingdom_{name}', None)
+
+
+def _table_estimate(session, mapper):
+    table = mapper.local_table
+    bind = session.get_bind(mapper)
+    if bind.dialect.name == 'postgresql':
+        sql = 'SELECT reltuples FROM pg_class WHERE oid = to_regclass(:t)'
+    elif bind.dialect.name == 'mysql':
+        sql = ('SELECT table_rows FROM information_schema.tables '
+               'WHERE table_schema = DATABASE() AND table_name = :t')
+    else:
+        return None
+
+    rv = session.execute(text(sql), {'t': table.name}, bind=bind).scalar()
+    if rv is None or rv < 0:
+        return None
+    return int(rv)
+
+
+def _filter_key(prefix, kwargs):
+    return prefix + '-'.join(['%s$%s' % (k, kwargs[k]) for k in kwargs])
+
+
+def _touch_marker(model):
+    # a fresh token instead of a counter, so an evicted marker can never
+    # come back with a value a client has already seen
+    rv = uuid.uuid4().hex
+    cache.set(model.generate_cache_prefix('marker'), rv, CACHE_TIMES['marker'])
+    return rv
+
+
+def _mark_write(model):
+    prop = _cache_property(model)
+    if prop is not None:
+        prop.router.mark_write(getattr(model, '__bind_key__', None))
+
+
+def _ident_clause(session, mapper, idents):
+    pk = mapper.primary_key
+    if len(pk) == 1:
+        return pk[0].in_(idents)
+    if _supports_row_values(session.get_bind(mapper).dialect):
+        return tuple_(*pk).in_([tuple(i) for i in idents])
+    return or_(*[and_(*[c == v for c, v in zip(pk, i)]) for i in idents])
+
+
+def _supports_row_values(dialect):
+    if dialect.name in ('mssql', 'sybase', 'firebird'):
+        return False
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 15)
+    return True
+
+
+def _ident_suffix(ident):
+    if isinstance(ident, (list, tuple)):
+        return '-'.join(map(str, ident))
+    return str(ident)
+
+
+def _ident_key(ident):
+    if isinstance(ident, (list, tuple)):
+        return tuple(ident)
+    return str(ident)
 
 
 def _unique_suffix(target, primary_key):
@@ -201,6 +815,6 @@ def _unique_key(target, primary_key):
 
 def _itervalues(data, ident):
     for k in ident:
-        item = data[str(k)]
+        item = data[_ident_key(k)]
         if item is not None:
             yield item
@@ -4,7 +4,6 @@
    ~~~~~~~~~~~~~~~~~
 """
 
-from flask import json
 from werkzeug.exceptions import HTTPException
 from werkzeug._compat import text_type
 
@@ -21,6 +20,8 @@ class APIException(HTTPException):
         super(APIException, self).__init__(description, response)
 
     def get_body(self, environ=None):
+        from flask import json
+
         return text_type(json.dumps(dict(
             error=self.error,
             error_description=self.description,
@@ -38,6 +39,8 @@ class FormError(APIException):
         super(FormError, self).__init__(None, response)
 
     def get_body(self, environ=None):
+        from flask import json
+
         return text_type(json.dumps(dict(
             error=self.error,
             error_form=self.form.errors,
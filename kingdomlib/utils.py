@@ -5,7 +5,6 @@
 """
 
 from datetime import date, datetime
-from flask import request
 
 ROBOT_BROWSERS = ('google', 'msn', 'yahoo', 'ask', 'aol')
 ROBOT_KEYWORDS = ('spider', 'bot', 'crawler', '+http')
@@ -23,6 +22,8 @@ def xmldatetime(date):
 
 
 def is_robot():
+    from flask import request
+
     ua = str(request.user_agent).lower()
     for key in ROBOT_KEYWORDS:
         if key in ua:
@@ -31,6 +32,8 @@ def is_robot():
 
 
 def is_mobile():
+    from flask import request
+
     return request.user_agent.platform in MOBILE_PLATFORMS
 
 
@@ -45,6 +48,8 @@ def is_not_blank(value=None):
 
 
 def is_json():
+    from flask import request
+
     if request.is_xhr:
         return True
 
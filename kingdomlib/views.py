@@ -4,12 +4,19 @@
    ~~~~~~~~~~~~~~~~
 """
 
+import hashlib
+from functools import wraps
+
 from werkzeug.datastructures import MultiDict
-from flask import request
+from flask import current_app, make_response, request
 from flask_wtf import FlaskForm
 
+from .cache import cache, ONE_HOUR
 from .errors import FormError
 
+# headers of a cached response replayed to every client
+CACHED_HEADERS = ('Content-Type', 'Content-Encoding')
+
 
 class SimpleView(object):
     def __init__(self, name=None):
@@ -31,6 +38,73 @@ class SimpleView(object):
             bp.add_url_rule(url_prefix + rule, endpoint, f, **options)
 
 
+def conditional(*models, cache_response=False, expire=ONE_HOUR,
+                vary=None):
+    """Answer ``GET`` requests with an ETag built from the request path and
+    the :meth:`BaseMixin.cache_marker` of ``models``, and with
+    ``304 Not Modified`` without running the view when the client already
+    has it. Only ``200`` responses get an ETag or are cached.
+
+    The ETag does not know about the user or the ``Accept`` headers. When
+    the response depends on them, pass ``vary``, a callable returning a
+    string mixed into the ETag, e.g. the current user id. Otherwise a
+    client may get a ``304`` for content rendered for someone else.
+
+    With ``cache_response`` the body is kept in the cache until one of the
+    models changes. Only ``Content-Type`` and ``Content-Encoding`` are kept
+    with it, other headers of the view are not replayed::
+
+        @view.route('/todos')
+        @conditional(Todo, cache_response=True, vary=lambda: g.user.id)
+        def todos():
+            ...
+    """
+    if not models:
+        raise TypeError('conditional() requires at least one model')
+
+    def wrapper(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+
+            etag = _model_etag(models, vary)
+            if etag in request.if_none_match:
+                rv = current_app.response_class(status=304)
+                rv.set_etag(etag)
+                return rv
+
+            key = f'view:{etag}'
+            if cache_response:
+                rv = cache.get(key)
+                if rv is not None:
+                    body, headers = rv
+                    rv = current_app.response_class(body, 200, headers)
+                    rv.set_etag(etag)
+                    return rv
+
+            rv = make_response(f(*args, **kwargs))
+            if rv.status_code != 200:
+                return rv
+            rv.set_etag(etag)
+            if cache_response:
+                headers = [(k, v) for k, v in rv.headers
+                           if k in CACHED_HEADERS]
+                cache.set(key, (rv.get_data(), headers), expire)
+            return rv
+        return decorated
+    return wrapper
+
+
+def _model_etag(models, vary=None):
+    h = hashlib.md5(request.full_path.encode('utf-8'))
+    for model in models:
+        h.update(model.cache_marker().encode('utf-8'))
+    if vary is not None:
+        h.update(b'\0' + str(vary()).encode('utf-8'))
+    return h.hexdigest()
+
+
 class SimpleForm(FlaskForm):
     @classmethod
     def create_api_form(cls, obj=None):
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+
+from kingdomlib.cache import CacheFactory
+from kingdomlib.database import BaseMixin, CacheProperty
+
+db = SQLAlchemy(session_options={
+    'expire_on_commit': False,
+    'autoflush': False,
+})
+
+
+class Base(db.Model, BaseMixin):
+    __abstract__ = True
+    cache = CacheProperty(db)
+
+
+class Todo(Base):
+    __count_dimensions__ = ('status',)
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Member(Base):
+    group_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    role = db.Column(db.String(10))
+
+
+class Archive(Base):
+    __bind_key__ = 'archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50))
+
+
+class Tag(Base):
+    __count_distinct__ = ('label',)
+
+    id = db.Column(db.Integer, primary_key=True)
+    label = db.Column(db.String(20))
+
+
+@pytest.fixture
+def app(tmpdir):
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY='secret',
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmpdir.join('primary.db')),
+        SQLALCHEMY_BINDS={
+            'replica1': 'sqlite:///' + str(tmpdir.join('replica1.db')),
+            'replica2': 'sqlite:///' + str(tmpdir.join('replica2.db')),
+            'archive': 'sqlite:///' + str(tmpdir.join('archive.db')),
+        },
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        CACHE_TYPE='simple',
+    )
+    db.init_app(app)
+    CacheFactory(app)
+    with app.app_context():
+        db.create_all(bind=[None, 'archive'])
+        yield app
+        db.session.remove()
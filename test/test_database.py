@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from kingdomlib import database
+from kingdomlib.cache import cache
+
+from conftest import db, Member, Tag, Todo
+
+
+def add_members():
+    db.session.add_all([
+        Member(group_id=1, user_id=10, role='owner'),
+        Member(group_id=1, user_id=20, role='member'),
+        Member(group_id=2, user_id=10, role='member'),
+    ])
+    db.session.commit()
+
+
+def test_get_dict(app):
+    db.session.add_all([Todo(name='a'), Todo(name='b')])
+    db.session.commit()
+
+    rv = Todo.cache.get_dict([1, 2, 3])
+    assert rv['1'].name == 'a'
+    assert rv['2'].name == 'b'
+    assert rv['3'] is None
+    assert cache.get(Todo.generate_cache_prefix('get') + '1').name == 'a'
+    assert [t.name for t in Todo.cache.get_many([2, 3, 1])] == ['b', 'a']
+
+
+def test_get_dict_composite(app):
+    add_members()
+
+    idents = [(1, 10), (2, 10), (3, 30)]
+    for _ in range(2):
+        rv = Member.cache.get_dict(idents)
+        assert set(rv) == set(idents)
+        assert rv[(1, 10)].role == 'owner'
+        assert rv[(2, 10)].role == 'member'
+        assert rv[(3, 30)] is None
+
+    # same key format as get and the listeners
+    item = cache.get(Member.generate_cache_prefix('get') + '1-10')
+    assert item.role == 'owner'
+    assert Member.cache.get((1, 10)).role == 'owner'
+
+    rv = Member.cache.get_many([(3, 30), (1, 20)], clean=False)
+    assert rv[0] is None
+    assert rv[1].role == 'member'
+
+
+def test_get_dict_composite_without_row_values(app, monkeypatch):
+    add_members()
+    monkeypatch.setattr(database, '_supports_row_values', lambda d: False)
+
+    rv = Member.cache.get_dict([(1, 20), (2, 10)])
+    assert rv[(1, 20)].user_id == 20
+    assert rv[(2, 10)].group_id == 2
+
+
+def add_todos(*statuses):
+    db.session.add_all([Todo(name=f't{i}', status=s)
+                        for i, s in enumerate(statuses)])
+    db.session.commit()
+
+
+def cached_count(**kwargs):
+    key, _ = database._count_key(Todo, kwargs)
+    return cache.get(key)
+
+
+def test_filter_count_maintained(app):
+    add_todos(0, 0, 0)
+    assert Todo.cache.filter_count() == 3
+    assert Todo.cache.filter_count(status=0) == 3
+
+    add_todos(1)
+    assert cached_count() == 4
+    assert cached_count(status=0) == 3
+    assert Todo.cache.filter_count(status=1) == 1
+
+    db.session.delete(Todo.query.get(1))
+    db.session.commit()
+    assert cached_count() == 3
+    assert cached_count(status=0) == 2
+
+
+def test_filter_count_update_expired(app):
+    add_todos(0, 0, 1)
+    assert Todo.cache.filter_count(status=0) == 2
+    assert Todo.cache.filter_count(status=2) == 0
+
+    t = Todo.query.get(1)
+    db.session.expire(t)
+    t.status = 2
+    db.session.commit()
+    assert cached_count(status=0) == 1
+    assert cached_count(status=2) == 1
+
+
+def test_filter_count_rollback(app):
+    add_todos(0, 0, 0)
+    assert Todo.cache.filter_count() == 3
+
+    db.session.add(Todo(name='gone', status=0))
+    db.session.flush()
+    db.session.rollback()
+    assert cached_count() == 3
+
+
+def test_missing_counter_is_not_created(app):
+    add_todos(0)
+    assert cached_count() is None
+    assert cached_count(status=0) is None
+    assert Todo.cache.filter_count() == 1
+
+
+def test_count_distinct(app):
+    fakeredis = pytest.importorskip('fakeredis')
+    app.extensions['kingdom_redis'] = fakeredis.FakeStrictRedis()
+
+    db.session.add_all([Tag(label='a'), Tag(label='b'), Tag(label='a'),
+                        Tag(label=None)])
+    db.session.commit()
+    assert Tag.cache.count_distinct('label') == 2
+
+    db.session.add_all([Tag(label='c'), Tag(label=None)])
+    db.session.commit()
+    assert Tag.cache.count_distinct('label') == 3
+
+    db.session.add(Tag(label='d'))
+    db.session.flush()
+    db.session.rollback()
+    assert Tag.cache.count_distinct('label') == 3
+
+
+def test_dimension_counters_expire_quickly(app):
+    add_todos(0)
+    assert database._count_key(Todo, {'status': 0})[1] == \
+        database.CACHE_TIMES['fc']
+
+
+def test_approximate_count(app, monkeypatch):
+    add_todos(0, 1, 1)
+    # sqlite has no table statistics, fall back to filter_count
+    assert Todo.cache.approximate_count() == 3
+    assert Todo.cache.approximate_count(status=1) == 2
+
+    # the maintained counter wins over estimates
+    monkeypatch.setattr(database, '_table_estimate', lambda s, m: 40)
+    assert Todo.cache.approximate_count() == 3
+
+    cache.clear()
+    assert Todo.cache.approximate_count() == 40
+    assert cache.get(Todo.generate_cache_prefix('approx')) == 40
+    assert cached_count() is None
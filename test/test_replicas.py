@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+from flask import session
+from sqlalchemy.exc import InvalidRequestError
+
+from kingdomlib.cache import cache
+from kingdomlib.database import CACHE_TIMES, ReplicaRouter
+
+from conftest import db, Archive, Base, Todo
+
+BINDS = (None, 'replica1', 'replica2')
+
+
+@pytest.fixture
+def router(app, monkeypatch):
+    for bind in BINDS:
+        engine = db.get_engine(bind=bind)
+        if bind is not None:
+            Todo.__table__.create(engine)
+        engine.execute(Todo.__table__.insert(), [
+            {'id': 1, 'name': bind or 'primary', 'status': 0},
+        ])
+    # the primary is ahead of its replicas
+    db.engine.execute(Todo.__table__.insert(), [
+        {'id': 2, 'name': 'primary', 'status': 0},
+    ])
+    app.config['KINGDOM_DATABASE_REPLICAS'] = ['replica1', 'replica2']
+
+    router = ReplicaRouter(db)
+    monkeypatch.setattr(Base.__dict__['cache'], 'router', router)
+    return router
+
+
+def read_name(ident=1):
+    cache.clear()
+    item = Todo.cache.get(ident)
+    return item and item.name
+
+
+def test_round_robin(router):
+    names = [read_name() for _ in range(4)]
+    assert names == ['replica1', 'replica2', 'replica1', 'replica2']
+
+
+def test_least_latency(router):
+    router.strategy = 'least_latency'
+    router._latency = {'replica1': 1.0, 'replica2': 0.1}
+    assert read_name() == 'replica2'
+
+
+def test_replica_items_cached_shortly(app, router):
+    assert read_name() == 'replica1'
+    key = Todo.generate_cache_prefix('get') + '1'
+    expires, _ = app.extensions['kingdom_cache']._cache[key]
+    assert expires - time.time() <= CACHE_TIMES['replica']
+
+
+def test_items_are_detached(router):
+    item = Todo.cache.get(1)
+    item.name = 'changed'
+    db.session.add(item)
+    db.session.commit()
+    assert db.engine.execute('SELECT name FROM todo WHERE id = 1').scalar() \
+        == 'changed'
+
+
+def test_fallback(app, tmpdir, router):
+    app.config['SQLALCHEMY_BINDS']['broken'] = \
+        'sqlite:///' + str(tmpdir.join('missing', 'broken.db'))
+    app.config['KINGDOM_DATABASE_REPLICAS'] = ['nope', 'broken', 'replica2']
+    assert read_name() == 'replica2'
+    assert set(router._down) == {'nope', 'broken'}
+
+    app.config['KINGDOM_DATABASE_REPLICAS'] = ['nope', 'broken']
+    assert read_name() == 'primary'
+
+
+def test_maintained_counts_read_primary(router):
+    assert Todo.cache.filter_count() == 2
+    assert Todo.cache.filter_count(status=0) == 2
+    # not maintained, so a replica is good enough
+    assert Todo.cache.filter_count(name='primary') == 0
+
+
+def test_bind_key(app, router):
+    for bind in ('archive', 'replica1'):
+        engine = db.get_engine(bind=bind)
+        if bind == 'replica1':
+            Archive.__table__.create(engine)
+        engine.execute(Archive.__table__.insert(), [{'id': 1, 'name': bind}])
+    # replica1 replicates the default database, not the archive
+    assert Archive.cache.get(1).name == 'archive'
+
+    app.config['KINGDOM_DATABASE_REPLICAS'] = {None: ['replica2']}
+    assert read_name() == 'replica2'
+
+
+def test_read_your_writes(app, router):
+    # a new app context, so that g does not outlive the request
+    with app.app_context(), app.test_request_context('/'):
+        db.session.add(Todo(name='new'))
+        db.session.commit()
+        assert read_name() == 'primary'
+
+    with app.test_request_context('/'):
+        session['_kingdom_write'] = int(time.time())
+        assert read_name() == 'primary'
+
+    with app.test_request_context('/'):
+        session['_kingdom_write'] = int(time.time()) - router.window - 1
+        assert read_name() == 'replica1'
+
+
+def test_query_errors_keep_replicas(router):
+    with pytest.raises(InvalidRequestError):
+        Todo.cache.filter_first(nosuchcol=1)
+    assert router._down == {}
+    assert read_name() in ('replica1', 'replica2')
+
+
+def test_writes_outside_requests(router):
+    # workers and CLI commands keep one app context, they only lose
+    # the replicas while a request is active
+    db.session.add(Todo(name='new'))
+    db.session.commit()
+    assert read_name() == 'replica1'
+
+
+def test_no_replicas_no_session(app):
+    @app.route('/todos', methods=['GET', 'POST'])
+    def todos():
+        db.session.add(Todo(name='new'))
+        db.session.commit()
+        return Todo.cache.get(1).name
+
+    rv = app.test_client().post('/todos')
+    assert rv.status_code == 200
+    assert 'Set-Cookie' not in rv.headers
+    assert 'Cookie' not in rv.headers.get('Vary', '')
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from flask import Blueprint, jsonify
+
+from kingdomlib.views import SimpleView, conditional
+
+from conftest import db, Todo
+
+
+@pytest.fixture
+def client(app):
+    calls = []
+    view = SimpleView('todos')
+
+    @view.route('/')
+    @conditional(Todo, cache_response=True)
+    def index():
+        calls.append('index')
+        return jsonify([t.name for t in Todo.query.all()])
+
+    @view.route('/<int:ident>')
+    @conditional(Todo, cache_response=True)
+    def show(ident):
+        calls.append('show')
+        todo = Todo.query.get(ident)
+        if todo is None:
+            return jsonify(error='not_found'), 404
+        return jsonify(name=todo.name)
+
+    bp = Blueprint('api', __name__)
+    view.register(bp)
+    app.register_blueprint(bp)
+    client = app.test_client()
+    client.calls = calls
+    return client
+
+
+def test_not_modified(client):
+    rv = client.get('/todos/')
+    etag = rv.headers['ETag']
+    assert rv.status_code == 200
+
+    rv = client.get('/todos/', headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+    rv = client.get('/todos/')
+    assert rv.status_code == 200
+    assert rv.headers['ETag'] == etag
+    assert client.calls == ['index']
+
+
+def test_marker_rotates_on_commit(client):
+    etag = client.get('/todos/').headers['ETag']
+
+    db.session.add_all([Todo(name='a'), Todo(name='b')])
+    db.session.flush()
+    assert client.get('/todos/').headers['ETag'] == etag
+    db.session.rollback()
+    assert client.get('/todos/').headers['ETag'] == etag
+
+    db.session.add_all([Todo(name='a'), Todo(name='b')])
+    db.session.commit()
+    rv = client.get('/todos/', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert rv.headers['ETag'] != etag
+    assert rv.json == ['a', 'b']
+
+
+def test_errors_are_not_cached(client):
+    rv = client.get('/todos/1')
+    assert rv.status_code == 404
+    assert 'ETag' not in rv.headers
+
+    client.get('/todos/1')
+    assert client.calls == ['show', 'show']
+
+
+def test_models_required():
+    with pytest.raises(TypeError):
+        conditional()
+
+
+def test_cached_headers(app, client):
+    @app.route('/profile')
+    @conditional(Todo, cache_response=True)
+    def profile():
+        client.calls.append('profile')
+        rv = jsonify(name='a')
+        rv.set_cookie('user', 'a')
+        rv.headers['X-User'] = 'a'
+        return rv
+
+    rv = client.get('/profile')
+    assert rv.headers['X-User'] == 'a'
+
+    rv = client.get('/profile')
+    assert client.calls == ['profile']
+    assert rv.json == {'name': 'a'}
+    assert rv.content_type == 'application/json'
+    assert 'Set-Cookie' not in rv.headers
+    assert 'X-User' not in rv.headers
+
+
+def test_vary(app):
+    user = {'id': 1}
+
+    @app.route('/me')
+    @conditional(Todo, vary=lambda: user['id'])
+    def me():
+        return jsonify(id=user['id'])
+
+    client = app.test_client()
+    etag = client.get('/me').headers['ETag']
+    assert client.get('/me', headers={'If-None-Match': etag}).status_code \
+        == 304
+
+    user['id'] = 2
+    rv = client.get('/me', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert rv.json == {'id': 2}
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from kingdomlib import database
+from kingdomlib.cache import cache
+from kingdomlib.database import BaseMixin, warm_cache
+
+from conftest import db, Member, Todo
+
+
+class Plain(BaseMixin):
+    """Not mapped, the registry has to skip it"""
+
+
+@pytest.fixture
+def todos(app):
+    now = datetime.utcnow()
+    db.engine.execute(Todo.__table__.insert(), [
+        {'id': 1, 'name': 'a', 'status': 0,
+         'created_at': now - timedelta(days=3)},
+        {'id': 2, 'name': 'b', 'status': 1, 'created_at': now},
+        {'id': 3, 'name': 'c', 'status': 1, 'created_at': now},
+    ])
+
+
+@pytest.fixture
+def runner(app):
+    database.init_app(app)
+    return app.test_cli_runner()
+
+
+def cached_names():
+    prefix = Todo.generate_cache_prefix('get')
+    rv = cache.get_dict(*[prefix + str(i) for i in (1, 2, 3)])
+    return sorted(v.name for v in rv.values() if v is not None)
+
+
+def test_warm_scan(todos):
+    assert warm_cache(Todo, chunk_size=2) == 3
+    assert cached_names() == ['a', 'b', 'c']
+    # warmed under the keys CacheQuery.get reads
+    db.engine.execute('DELETE FROM todo')
+    assert Todo.cache.get(2).name == 'b'
+    assert Todo.cache.filter_count() == 3
+
+
+def test_warm_ids_and_since(todos):
+    assert warm_cache(Todo, ids=[1, 3]) == 2
+    assert cached_names() == ['a', 'c']
+
+    cache.clear()
+    since = datetime.utcnow() - timedelta(days=1)
+    assert warm_cache(Todo, since=since) == 2
+    assert cached_names() == ['b', 'c']
+
+    with pytest.raises(ValueError):
+        warm_cache(Todo, since=since, since_column='updated_at')
+
+
+def test_warm_counts(todos):
+    warm_cache(Todo, counts=[{'status': 1}, {'name': 'a'}], jitter=0)
+    db.engine.execute('DELETE FROM todo')
+    assert Todo.cache.filter_count() == 3
+    assert Todo.cache.filter_count(status=1) == 2
+    assert Todo.cache.filter_count(name='a') == 1
+
+
+def test_warm_composite_ids(app):
+    db.engine.execute(Member.__table__.insert(), [
+        {'group_id': 1, 'user_id': 10, 'role': 'owner'},
+        {'group_id': 2, 'user_id': 10, 'role': 'member'},
+    ])
+    assert warm_cache(Member, ids=[(1, 10)]) == 1
+    assert cache.get(Member.generate_cache_prefix('get') + '1-10')
+
+
+def test_command(todos, runner):
+    rv = runner.invoke(args=['warm-cache', 'Todo', '--ids', '1,2',
+                             '--count', 'status=1'])
+    assert rv.exit_code == 0
+    assert 'Todo: 2 rows warmed' in rv.output
+    assert cached_names() == ['a', 'b']
+    assert cache.get(Todo.generate_cache_prefix('fc') + 'status$1') == 2
+
+    rv = runner.invoke(args=['warm-cache', 'todo', '--since', '3600'])
+    assert 'todo: 2 rows warmed' in rv.output
+
+
+def test_command_composite_ids(app, runner):
+    db.engine.execute(Member.__table__.insert(), [
+        {'group_id': 1, 'user_id': 2, 'role': 'owner'},
+    ])
+    rv = runner.invoke(args=['warm-cache', 'Member', '--ids', '1-2'])
+    assert 'Member: 1 rows warmed' in rv.output
+    assert cache.get(Member.generate_cache_prefix('get') + '1-2')
+
+    rv = runner.invoke(args=['warm-cache', 'Member', '--ids', '1'])
+    assert rv.exit_code == 2
+    assert 'Member ids need 2 parts' in rv.output
+
+
+@pytest.mark.parametrize('args, error', [
+    (['Nope'], 'No such model: Nope'),
+    (['Member', '--since', '60'], 'Member has no column created_at'),
+    (['Todo', '--count', 'status'], '--count expects key=value pairs'),
+    (['Todo', '--count', 'nope=1'], 'Todo has no column nope'),
+])
+def test_command_bad_parameter(todos, runner, args, error):
+    rv = runner.invoke(args=['warm-cache'] + args)
+    assert rv.exit_code == 2
+    assert error in rv.output